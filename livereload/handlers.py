@@ -53,7 +53,7 @@ class LiveReloadHandler(WebSocketHandler):
         if cls._last_reload_time:
             return
 
-        if not cls.watcher._tasks:
+        if not cls.watcher._task_paths:
             logger.info('Watch current working directory')
             cls.watcher.watch(os.getcwd())
 
@@ -64,8 +64,18 @@ class LiveReloadHandler(WebSocketHandler):
             ioloop.PeriodicCallback(cls.poll_tasks, 800).start()
 
     @classmethod
-    def poll_tasks(cls):
-        filepaths, delay = cls.watcher.examine()
+    def poll_tasks(cls, changes=None):
+        """Examine the watcher and reload the waiters if needed.
+
+        :param changes: paths a notifying watcher saw changing since the
+                        last call, checked instead of the whole tree.
+        """
+        if changes:
+            logger.debug('Changes reported: %s', changes)
+            filepaths, delay = cls.watcher.examine(changes)
+        else:
+            # custom watchers may not take the changes argument
+            filepaths, delay = cls.watcher.examine()
         if len(filepaths) == 0 or delay == 'forever' or not cls.waiters:
             return
         reload_time = 3
@@ -8,12 +8,18 @@
     :license: BSD, see LICENSE for more details.
 """
 
+import atexit
 import fnmatch
 import glob
+import hashlib
+import json
 import logging
 import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from inspect import signature
+from stat import S_ISDIR, S_ISREG
 
 try:
     import pyinotify
@@ -22,19 +28,110 @@ except ImportError:
 
 logger = logging.getLogger("livereload")
 
+# remember directory listings between polls, see Watcher._scandir_walk
+_CACHE_DIR_LISTINGS = os.name != "nt"
+
+# seconds after its mtime until a directory listing can be cached. A
+# directory modified more recently might be modified again without its
+# mtime changing, FAT and some SMB mounts only store it in 2s steps
+_MTIME_SETTLE = 2
+
+_CACHE_HOME = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+    os.path.expanduser("~"), ".cache"
+)
+
+
+# fnmatch.translate wraps its result in these, e.g. "(?s:" and ")\Z"
+_TRANSLATE_HEAD, _TRANSLATE_TAIL = fnmatch.translate("x").split("x")
+
+# a "**/" segment of a glob pattern, see _translate_glob
+_DIRS_SEGMENT_RE = re.compile(r"(?:^|(?<=/))\*\*/")
+
+# glob pattern -> compiled regular expression, see matches_glob
+_pattern_cache = {}
+
+
+def _translate_glob(glob_pattern):
+    """Translate a glob pattern into a regular expression string.
+
+    Works like fnmatch.translate, except that a ``**/`` segment matches any
+    number of directories, including none. ``**/`` only counts as a segment
+    at the start of the pattern or after a ``/``.
+    """
+    head_len, tail_len = len(_TRANSLATE_HEAD), len(_TRANSLATE_TAIL)
+    parts = [
+        fnmatch.translate(part)[head_len:-tail_len]
+        for part in _DIRS_SEGMENT_RE.split(glob_pattern)
+    ]
+    return _TRANSLATE_HEAD + "(?:.*/)?".join(parts) + _TRANSLATE_TAIL
+
+
+def _compile_globs(glob_patterns):
+    """Compile glob patterns into one regular expression matching any of
+    them, or return None if there are no patterns."""
+    if not glob_patterns:
+        return None
+    return re.compile("|".join(_translate_glob(p) for p in glob_patterns))
+
 
 def matches_glob(path, glob_pattern):
-    processed_pattern = glob_pattern.replace("/**/", "*/")
-    return fnmatch.fnmatchcase(path, processed_pattern)
+    regex = _pattern_cache.get(glob_pattern)
+    if regex is None:
+        regex = _pattern_cache[glob_pattern] = re.compile(
+            _translate_glob(glob_pattern)
+        )
+    return regex.match(path) is not None
+
+
+def _fingerprint(stat_result):
+    # the size catches edits within the mtime resolution of
+    # filesystems with coarse timestamps
+    return (stat_result.st_mtime, stat_result.st_size)
+
+
+def _stat_paths(paths):
+    """Stat each path, using None for paths that can't be stat'ed."""
+    results = []
+    for path in paths:
+        try:
+            results.append(os.stat(path))
+        except (OSError, ValueError):
+            results.append(None)
+    return results
 
 
 class Watcher:
     """A file watcher registry."""
 
-    def __init__(self):
-        self._tasks = {}
+    #: number of threads used to scan the watched paths
+    task_workers = 8
+    #: number of threads used to stat the files matched by a glob pattern
+    stat_workers = 8
+    #: globs matching fewer files than this are stat'ed in the calling thread
+    stat_batch_min = 64
+    #: file keeping the fingerprints of watched files between runs, so the
+    #: first check after a restart only reports what changed meanwhile.
+    #: Set to None to disable.
+    cache_file = os.path.join(_CACHE_HOME, "django-livereload", "mtimes.json")
+    #: number of tasks kept in cache_file, those saved longest ago are
+    #: dropped first
+    cache_size = 64
 
-        # modification time of filepaths for each task,
+    def __init__(self):
+        # tasks are stored as parallel lists, one entry per watched path,
+        # and _task_index maps a path to its position
+        self._task_index = {}
+        self._task_paths = []
+        self._task_funcs = []
+        self._task_delays = []
+        self._task_ignores = []
+        self._task_mtime_dicts = []
+        self._task_names = []
+        self._task_accepts_arg = []
+        self._task_scans = []
+        self._task_keys = []
+
+        # (modification time, size) of filepaths for each task,
         # before and after checking for changes
         self._task_mtimes = {}
         self._new_mtimes = {}
@@ -46,6 +143,15 @@ class Watcher:
         self.filepaths = []
         self._start = time.time()
 
+        # executors only start their threads once work is submitted
+        self._task_pool = ThreadPoolExecutor(max_workers=self.task_workers)
+        self._stat_pool = ThreadPoolExecutor(max_workers=self.stat_workers)
+
+        # glob pattern -> (mtime of the directory holding the matches, matches)
+        self._glob_cache = {}
+        # directory -> (mtime, file names, names of not ignored subdirectories)
+        self._dir_listings = {}
+
         # list of ignored dirs
         self.ignored_dirs = [".git", ".hg", ".svn", ".cvs"]
 
@@ -54,27 +160,57 @@ class Watcher:
 
         self.ignore_patterns = ["pollen_src/**/compiled/*"]
 
+        # the ignore lists above in the form they are checked in
+        self._ignored_dirs = frozenset()
+        self._ignored_file_extensions = ()
+        self._ignore_globs = ()
+        self._ignore_re = None
+        self._update_ignores()
+
+        # fingerprints saved by a previous run, by task key
+        self._saved_mtimes = self._load_mtimes()
+        if self.cache_file:
+            atexit.register(self._save_mtimes)
+
+    def _update_ignores(self):
+        """Rebuild the checked forms of the ignore lists, picking up changes
+        made to the lists directly rather than through the methods below."""
+        ignored_dirs = frozenset(self.ignored_dirs)
+        if ignored_dirs != self._ignored_dirs:
+            self._ignored_dirs = ignored_dirs
+            self._dir_listings.clear()
+
+        self._ignored_file_extensions = tuple(self.ignored_file_extensions)
+
+        ignore_globs = tuple(self.ignore_patterns)
+        if ignore_globs != self._ignore_globs:
+            self._ignore_globs = ignore_globs
+            self._ignore_re = _compile_globs(ignore_globs)
+
     def ignore_dirs(self, *args):
         self.ignored_dirs.extend(args)
+        self._update_ignores()
 
     def remove_dirs_from_ignore(self, *args):
         for a in args:
             self.ignored_dirs.remove(a)
+        self._update_ignores()
 
     def should_ignore(self, filename):
         """Should ignore a given filename?"""
-        _, ext = os.path.splitext(filename)
-        return ext in self.ignored_file_extensions
+        return filename.endswith(self._ignored_file_extensions)
 
     def should_ignore_by_glob(self, path):
         """Check if the given path matches any of the ignore patterns."""
-        for pattern in self.ignore_patterns:
-            if matches_glob(path, pattern):
-                return True
-        return False
+        return self._ignore_re is not None and self._ignore_re.match(path) is not None
+
+    def add_ignore_pattern(self, pattern):
+        self.ignore_patterns.append(pattern)
+        self._update_ignores()
 
     def ignore_file_extension(self, extension):
         self.ignored_file_extensions.append(extension)
+        self._update_ignores()
 
     def watch(self, path, func=None, delay=0, ignore=None):
         """Add a task to watcher.
@@ -87,46 +223,181 @@ class Watcher:
         :param ignore: A function return True to ignore a certain pattern of
                        filepath.
         """
-        self._tasks[path] = {
-            "func": func,
-            "delay": delay,
-            "ignore": ignore,
-            "mtimes": {},
-        }
+        name = None
+        accepts_arg = False
+        if func:
+            name = getattr(func, "name", None)
+            if not name:
+                name = getattr(func, "__name__", "anonymous")
+            try:
+                accepts_arg = len(signature(func).parameters) > 0
+            except (TypeError, ValueError):
+                pass
+
+        scan = self._classify(path)
+        key = self._task_key(path, ignore)
+        i = self._task_index.get(path)
+        if i is None:
+            self._task_index[path] = len(self._task_paths)
+            self._task_paths.append(path)
+            self._task_funcs.append(func)
+            self._task_delays.append(delay)
+            self._task_ignores.append(ignore)
+            self._task_mtime_dicts.append(self._restore_mtimes(key))
+            self._task_names.append(name)
+            self._task_accepts_arg.append(accepts_arg)
+            self._task_scans.append(scan)
+            self._task_keys.append(key)
+        else:
+            self._task_funcs[i] = func
+            self._task_delays[i] = delay
+            self._task_ignores[i] = ignore
+            self._task_mtime_dicts[i] = self._restore_mtimes(key)
+            self._task_names[i] = name
+            self._task_accepts_arg[i] = accepts_arg
+            self._task_scans[i] = scan
+            self._task_keys[i] = key
+
+    def _task_key(self, path, ignore=None):
+        """Identify a task across runs by its path and ignore settings, so
+        saved fingerprints are dropped once the configuration changes.
+
+        Computed when the task is watched, later changes to the ignore
+        settings don't change the key the task is saved under. Relative
+        paths are resolved against the working directory, so that the same
+        relative path in two projects makes two tasks. The watcher class is
+        part of the key too, the fingerprints of a task depend on how its
+        watcher collects them.
+        """
+        watched = path[1] if isinstance(path, (list, tuple)) else path
+        if glob.has_magic(watched):
+            location = (os.getcwd(), watched)
+        else:
+            location = os.path.abspath(watched)
+        config = (
+            type(self).__name__,
+            path,
+            location,
+            self.ignored_dirs,
+            self.ignored_file_extensions,
+            self.ignore_patterns,
+            ignore and getattr(ignore, "__qualname__", None),
+        )
+        return hashlib.blake2b(repr(config).encode(), digest_size=16).hexdigest()
+
+    def _load_mtimes(self):
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file, encoding="utf-8") as f:
+                saved_mtimes = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            logger.debug(f"Ignoring unreadable {self.cache_file}", exc_info=True)
+            return {}
+        return saved_mtimes if isinstance(saved_mtimes, dict) else {}
+
+    def _restore_mtimes(self, key):
+        """Return the saved fingerprints of a task, without files that have
+        been removed meanwhile."""
+        mtimes = self._saved_mtimes.pop(key, None)
+        if not isinstance(mtimes, dict):
+            return {}
+        # JSON has no tuples, fingerprints come back as lists
+        return {p: tuple(fp) for p, fp in mtimes.items() if os.path.exists(p)}
+
+    def _save_mtimes(self):
+        """Write the fingerprints of all tasks to self.cache_file, keeping
+        those of up to cache_size other tasks, e.g. from other projects,
+        already in it."""
+        if not self.cache_file:
+            # disabled after the watcher was created
+            return
+        saved_mtimes = self._load_mtimes()
+        for key, mtimes in zip(self._task_keys, self._task_mtime_dicts):
+            # entries are kept in the order they were saved in
+            saved_mtimes.pop(key, None)
+            saved_mtimes[key] = mtimes
+        for key in list(saved_mtimes)[: -self.cache_size or None]:
+            del saved_mtimes[key]
+
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(saved_mtimes, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError:
+            logger.debug(f"Could not write {self.cache_file}", exc_info=True)
+
+    def _classify(self, path):
+        """Pick the scan to run for a watched path.
+
+        Done once when the path is watched, so examine() doesn't have to
+        find out on every poll whether it is a file, directory or glob.
+        """
+        if isinstance(path, (list, tuple)):
+            path = path[1]
+
+        try:
+            mode = os.stat(path).st_mode
+        except (OSError, ValueError):
+            mode = 0
+
+        if S_ISREG(mode):
+            return self._snapshot_file
+        if S_ISDIR(mode):
+            return self._snapshot_folder
+        if glob.has_magic(path):
+            return self._snapshot_glob
+        # doesn't exist yet, decide once it does
+        return self._snapshot_path
+
+    def _task_scan(self, path):
+        i = self._task_index.get(path)
+        if i is None:
+            return self._classify(path)
+        return self._task_scans[i]
 
     def start(self, callback):
         """Start the watcher running, calling callback when changes are
         observed. If this returns False, regular polling will be used."""
         return False
 
-    def examine(self):
+    def examine(self, changes=None):
         """Check if there are changes. If so, run the given task.
 
         Returns a tuple of modified filepath and reload delay.
+
+        :param changes: paths reported as changed by the watcher's own
+                        notifications. The polling watcher checks everything
+                        regardless.
         """
         if self._changes:
             return self._changes.pop()
+        return self._run_tasks()
+
+    def _run_tasks(self):
+        """Check every task and run the functions of those that changed.
+
+        Returns a tuple of modified filepath and reload delay.
+        """
+        self._update_ignores()
 
         # clean filepaths
         self.filepaths = []
         delays = set()
-        for path in self._tasks:
-            item = self._tasks[path]
-            self._task_mtimes = item["mtimes"]
-            changed = self.is_changed(path, item["ignore"])
+        for i, changed in enumerate(self._check_tasks()):
             if changed:
-                func = item["func"]
-                delay = item["delay"]
+                func = self._task_funcs[i]
+                delay = self._task_delays[i]
                 if delay and isinstance(delay, float):
                     delays.add(delay)
                 if func:
-                    name = getattr(func, "name", None)
-                    if not name:
-                        name = getattr(func, "__name__", "anonymous")
+                    name = self._task_names[i]
                     logger.info(f"Running task: {name} (delay: {delay})")
-                    if len(signature(func).parameters) > 0 and isinstance(
-                        changed, list
-                    ):
+                    if self._task_accepts_arg[i] and isinstance(changed, list):
                         func(changed)
                     else:
                         func()
@@ -137,28 +408,76 @@ class Watcher:
             delay = None
         return self.filepaths, delay
 
+    def _check_tasks(self):
+        """Check every task in order, yielding what is_changed() would for
+        each.
+
+        Scanning the filesystem is mostly waiting for stat calls, which
+        release the GIL, so the tasks are scanned in parallel ahead of time.
+        Comparing the results updates the watcher's state and is done one
+        task at a time, and examine() runs the function of a changed task
+        before the next one is compared. That function may write files a
+        later task watches, like compiling *.scss into a watched *.css, so
+        once one has run the remaining tasks are scanned again, to see those
+        files in the same check.
+
+        Tasks with an ``ignore`` function are scanned when their turn comes,
+        user functions are only ever called from the calling thread.
+        """
+        indexes = range(len(self._task_paths))
+        ahead = [i for i in indexes if self._task_ignores[i] is None]
+        futures = {}
+        if len(ahead) > 1:
+            futures = {i: self._task_pool.submit(self._scan_task, i) for i in ahead}
+
+        ran_func = False
+        for i in indexes:
+            future = futures.get(i)
+            if future is None or ran_func:
+                snapshot = self._scan_task(i)
+            else:
+                snapshot = future.result()
+            changed = self._apply_task_snapshot(i, snapshot)
+            yield changed
+            ran_func = ran_func or bool(changed and self._task_funcs[i])
+
+    def _apply_task_snapshot(self, i, snapshot):
+        self._task_mtimes = self._task_mtime_dicts[i]
+        is_glob = self._task_scans[i] == self._snapshot_glob
+        return self._apply_snapshot(snapshot, is_glob)
+
+    def _scan_task(self, i):
+        path = self._task_paths[i]
+        if isinstance(path, (list, tuple)):
+            path = path[1]
+        return self._task_scans[i](path, self._task_ignores[i])
+
     def is_changed(self, path, ignore=None):
         """Check if any filepaths have been added, modified, or removed.
 
         Updates filepath modification times in self._task_mtimes.
         """
-        self._new_mtimes = {}
-        changed = False
+        scan = self._task_scan(path)
 
         if isinstance(path, (list, tuple)):
             path = path[1]
 
-        if os.path.isfile(path):
-            changed = self.is_file_changed(path, ignore)
-        elif os.path.isdir(path):
-            changed = self.is_folder_changed(path, ignore)
-        else:
-            changed = self.get_changed_glob_files(path, ignore)
+        return self._apply_snapshot(scan(path, ignore), scan == self._snapshot_glob)
+
+    def _apply_snapshot(self, snapshot, is_glob=False):
+        """Compare a new snapshot of a task against self._task_mtimes and
+        store it there.
 
+        Returns the changed filepaths for glob tasks, a bool otherwise.
+        """
+        self._new_mtimes = snapshot
+        changed = self._diff_snapshot(snapshot)
+        if not is_glob:
+            changed = bool(changed)
         if not changed:
             changed = self.is_file_removed()
 
-        self._task_mtimes.update(self._new_mtimes)
+        self._task_mtimes.update(snapshot)
         return changed
 
     def is_file_removed(self):
@@ -167,7 +486,7 @@ class Watcher:
         Deletes removed paths from self._task_mtimes.
         Sets self.filepath to one of the removed paths.
         """
-        removed_paths = set(self._task_mtimes) - set(self._new_mtimes)
+        removed_paths = self._task_mtimes.keys() - self._new_mtimes.keys()
         if not removed_paths:
             return False
 
@@ -184,92 +503,462 @@ class Watcher:
         Updates filepath modification times in self._new_mtimes.
         Sets self.filepath to changed path.
         """
-        if not os.path.isfile(path):
-            return False
-
-        if self.should_ignore(path):
-            return False
-
-        if self.should_ignore_by_glob(path):
-            # logger.info(f"Ignoring glob: {path}")
-            return False
-
-        if ignore and ignore(path):
-            return False
-
-        mtime = os.path.getmtime(path)
-
-        if path not in self._task_mtimes:
-            self._new_mtimes[path] = mtime
-            self.filepaths.append(path)
-            return mtime > self._start
-
-        if self._task_mtimes[path] != mtime:
-            self._new_mtimes[path] = mtime
-            self.filepaths.append(path)
-            return True
-
-        self._new_mtimes[path] = mtime
-        return False
+        snapshot = self._snapshot_file(path, ignore)
+        self._new_mtimes.update(snapshot)
+        return bool(self._diff_snapshot(snapshot))
 
     def is_folder_changed(self, path, ignore=None):
         """Check if directory path has any changed filepaths."""
-        change = False
-        for root, dirs, files in os.walk(path, followlinks=True):
-            for d in self.ignored_dirs:
-                if d in dirs:
-                    dirs.remove(d)
-
-            for f in files:
-                if self.is_file_changed(os.path.join(root, f), ignore):
-                    change = True
-        return change
+        snapshot = self._snapshot_folder(path, ignore)
+        self._new_mtimes.update(snapshot)
+        return bool(self._diff_snapshot(snapshot))
 
     def get_changed_glob_files(self, path, ignore=None):
         """Check if glob path has any changed filepaths."""
+        snapshot = self._snapshot_glob(path, ignore)
+        self._new_mtimes.update(snapshot)
+        return self._diff_snapshot(snapshot)
+
+    # The _snapshot_* methods collect the fingerprints of the watched files
+    # of a path without touching the state of the watcher, so they are safe
+    # to run in parallel.
+
+    def _snapshot_file(self, path, ignore=None):
+        if self._is_ignored(path, ignore):
+            return {}
+
         try:
-            files = glob.glob(path, recursive=True)
-            changed_files = [f for f in files if self.is_file_changed(f, ignore)]
+            stat_result = os.stat(path)
+        except (OSError, ValueError):
+            return {}
+
+        if not S_ISREG(stat_result.st_mode):
+            return {}
+        return {path: _fingerprint(stat_result)}
+
+    def _snapshot_folder(self, path, ignore=None):
+        return {
+            filepath: _fingerprint(stat_result)
+            for filepath, stat_result in self._scandir_walk(path, ignore)
+        }
+
+    def _snapshot_glob(self, path, ignore=None):
+        try:
+            files = [f for f in self._glob(path) if not self._is_ignored(f, ignore)]
+            return {
+                f: _fingerprint(stat_result)
+                for f, stat_result in zip(files, self._batch_stat(files))
+                if stat_result is not None and S_ISREG(stat_result.st_mode)
+            }
         except TypeError:
             """
             Problem: on every ~10 times for some reason the glob returns Path instead of a string
             TODO: Rewrite this block to use the python Path alongside string
             aka pathlib introduced in Python 3.4
             """
-            changed_files = []
-        return changed_files
+            return {}
+
+    def _snapshot_path(self, path, ignore=None):
+        """Snapshot a path that didn't exist when it was watched."""
+        try:
+            mode = os.stat(path).st_mode
+        except (OSError, ValueError):
+            return {}
+
+        if S_ISREG(mode):
+            return self._snapshot_file(path, ignore)
+        if S_ISDIR(mode):
+            return self._snapshot_folder(path, ignore)
+        return {}
+
+    def _scandir_walk(self, path, ignore=None):
+        """Yield ``(filepath, stat_result)`` for watched files below path.
+
+        Ignored directories are skipped before descending into them and
+        ignored files are skipped before they are stat'ed, so every yielded
+        file costs a single stat call.
+
+        Except on Windows, where os.scandir provides the stat results for
+        free, the names in each directory are remembered along with its
+        mtime. While that mtime is unchanged no files were added, removed or
+        renamed there, and the known files are stat'ed without listing the
+        directory again.
+        """
+        listings = self._dir_listings if _CACHE_DIR_LISTINGS else None
+        settled = time.time() - _MTIME_SETTLE
+        stack = [path]
+        while stack:
+            dirpath = stack.pop()
+            dir_mtime = None
+            if listings is not None:
+                try:
+                    dir_mtime = os.stat(dirpath).st_mtime
+                except (OSError, ValueError):
+                    listings.pop(dirpath, None)
+                    continue
+
+                listing = listings.get(dirpath)
+                if listing is not None and listing[0] == dir_mtime:
+                    _, filenames, dirnames = listing
+                    prefix = os.path.join(dirpath, "")
+                    stack.extend(prefix + name for name in dirnames)
+                    for name in filenames:
+                        filepath = prefix + name
+                        if self._is_ignored(filepath, ignore):
+                            continue
+                        try:
+                            stat_result = os.stat(filepath)
+                        except OSError:
+                            continue
+                        yield filepath, stat_result
+                    continue
+
+            try:
+                it = os.scandir(dirpath)
+            except OSError:
+                continue
+            filenames = []
+            dirnames = []
+            with it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if entry.name not in self._ignored_dirs:
+                                dirnames.append(entry.name)
+                                stack.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                        filenames.append(entry.name)
+                        filepath = entry.path
+                        if self._is_ignored(filepath, ignore):
+                            continue
+                        stat_result = entry.stat()
+                    except OSError:
+                        continue
+                    yield filepath, stat_result
+
+            if dir_mtime is not None and dir_mtime < settled:
+                listings[dirpath] = (dir_mtime, filenames, dirnames)
+
+    def _is_ignored(self, path, ignore=None):
+        return (
+            self.should_ignore(path)
+            or self.should_ignore_by_glob(path)
+            or bool(ignore and ignore(path))
+        )
+
+    def _diff_snapshot(self, snapshot):
+        """Compare a snapshot against the file fingerprints of the task.
+
+        Every added or modified filepath is appended to self.filepaths. The
+        returned list holds the filepaths that count as changed, that is
+        modified ones and those added after the watcher was started.
+        """
+        old_mtimes = self._task_mtimes
+        paths = [p for p, fp in snapshot.items() if old_mtimes.get(p) != fp]
+        if not paths:
+            return []
+
+        self.filepaths.extend(paths)
+        start = self._start
+        return [p for p in paths if p in old_mtimes or snapshot[p][0] > start]
+
+    def _glob(self, path):
+        """Return glob.glob(path), reusing the previous matches while the
+        directory holding them is unchanged.
+
+        Only patterns with wildcards in the last component alone are cached,
+        their matches can't change without the directory mtime changing.
+        """
+        parent = os.path.dirname(path)
+        if "**" in path or glob.has_magic(parent):
+            return glob.glob(path, recursive=True)
+
+        try:
+            dir_mtime = os.stat(parent or os.curdir).st_mtime
+        except (OSError, ValueError):
+            self._glob_cache.pop(path, None)
+            return []
+
+        cached = self._glob_cache.get(path)
+        if cached is not None and cached[0] == dir_mtime:
+            return cached[1]
+
+        files = glob.glob(path, recursive=True)
+        if dir_mtime < time.time() - _MTIME_SETTLE:
+            self._glob_cache[path] = (dir_mtime, files)
+        else:
+            self._glob_cache.pop(path, None)
+        return files
+
+    def _batch_stat(self, paths):
+        """Stat a list of paths, in parallel if there are many of them.
+
+        os.stat releases the GIL, so on slow or networked filesystems the
+        latencies of the calls overlap instead of adding up.
+        """
+        if len(paths) < self.stat_batch_min:
+            return _stat_paths(paths)
+
+        size = -(-len(paths) // self.stat_workers)
+        chunks = [paths[i : i + size] for i in range(0, len(paths), size)]
+        results = []
+        for chunk_results in self._stat_pool.map(_stat_paths, chunks):
+            results.extend(chunk_results)
+        return results
 
 
 class INotifyWatcher(Watcher):
+    #: milliseconds to wait for further events before calling back, so a
+    #: burst of events (a build, a branch switch) results in one callback
+    debounce_ms = 100
+    #: number of events buffered until the callback catches up, events
+    #: beyond that are dropped in favour of a full check
+    queue_size = 1024
+    #: number of times the inotify fd is read per IOLoop callback
+    drain_reads = 16
+
     def __init__(self):
         Watcher.__init__(self)
 
         self.wm = pyinotify.WatchManager()
+        fd = self.wm.get_fd()
+        os.set_blocking(fd, False)
+        os.set_inheritable(fd, False)
         self.notifier = None
         self.callback = None
+        self.ioloop = None
+        # events waiting to be batched, None stands for lost events
+        self._queue = None
+        # number of events dropped because the queue was full
+        self._dropped = 0
+
+        # events that can change a watched file, anything else
+        # (access, open, close without write) is dropped
+        self._event_mask = (
+            pyinotify.IN_CREATE
+            | pyinotify.IN_DELETE
+            | pyinotify.IN_MODIFY
+            | pyinotify.IN_MOVED_TO
+            | pyinotify.IN_MOVED_FROM
+        )
+
+        # paths reported by inotify since the last examine
+        self._pending_changes = set()
+        # set when the kernel queue overflowed and events were lost
+        self._rescan = False
+        # set by any event since the last examine
+        self._dirty = False
 
     def watch(self, path, func=None, delay=None, ignore=None):
-        flag = pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_MODIFY
-        self.wm.add_watch(path, flag, rec=True, do_glob=True, auto_add=True)
+        self.wm.add_watch(
+            path, self._event_mask, rec=True, do_glob=True, auto_add=True
+        )
         Watcher.watch(self, path, func, delay, ignore)
 
     def inotify_event(self, event):
-        self.callback()
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            pathname = None
+        elif event.mask & self._event_mask:
+            pathname = event.pathname
+            if not event.mask & pyinotify.IN_MODIFY:
+                # files were created, removed or renamed
+                self._glob_cache.clear()
+        else:
+            return
+
+        self._dirty = True
+        # events are only put and taken on the IOLoop thread, nothing can
+        # take from the queue in between
+        if self._queue.full():
+            self._dropped += 1
+            self._rescan = True
+        else:
+            self._queue.put_nowait(pathname)
+
+    async def _consume(self):
+        """Collect queued events into batches and hand each batch to the
+        callback, at most once per debounce_ms."""
+        from tornado.util import TimeoutError
+
+        while True:
+            pathname = await self._queue.get()
+            deadline = self.ioloop.time() + self.debounce_ms / 1000
+            changes = set()
+            while True:
+                if pathname is None:
+                    self._rescan = True
+                else:
+                    changes.add(pathname)
+                try:
+                    pathname = await self._queue.get(timeout=deadline)
+                except TimeoutError:
+                    break
+
+            if self._dropped:
+                logger.info(f"Dropped {self._dropped} events, checking all files")
+                self._dropped = 0
+            try:
+                self.callback(tuple(changes))
+            except Exception:
+                logger.error("Error handling changes", exc_info=True)
+
+    def examine(self, changes=None):
+        if changes:
+            # made absolute, like the task paths they are matched against
+            self._pending_changes.update(os.path.abspath(p) for p in changes)
+
+        if self._changes and not self._rescan:
+            return self._changes.pop()
+
+        if not (self._dirty or self._pending_changes or self._rescan):
+            # nothing happened, no need to look at any task
+            self.filepaths = []
+            return self.filepaths, None
+
+        try:
+            result = self._run_tasks()
+        finally:
+            self._pending_changes.clear()
+            self._rescan = False
+            self._dirty = False
+
+        # a full check can't wait behind setting changes, report those after
+        if self._changes:
+            return self._changes.pop()
+        return result
+
+    def _check_tasks(self):
+        if self._rescan:
+            yield from Watcher._check_tasks(self)
+            return
+
+        # only the reported paths are looked at, too little work to spread
+        # over threads. The files written by a task function are reported by
+        # later events, so once one has run the remaining tasks are checked
+        # in full, as Watcher does.
+        ran_func = False
+        for i, path in enumerate(self._task_paths):
+            if ran_func:
+                changed = self._apply_task_snapshot(i, self._scan_task(i))
+            else:
+                self._task_mtimes = self._task_mtime_dicts[i]
+                changed = self.is_changed(path, self._task_ignores[i])
+            yield changed
+            ran_func = ran_func or bool(changed and self._task_funcs[i])
+
+    def is_changed(self, path, ignore=None):
+        """Check the paths reported by inotify that belong to the task.
+
+        Falls back to a full check when events were lost, or for glob
+        patterns, which are only rechecked when something changed at all.
+
+        inotify reports absolute paths, they are mapped back below the task
+        path as it was watched, so the files are named and ignored the same
+        way as by a full check.
+        """
+        if self._rescan or (
+            self._pending_changes
+            and self._task_scan(path) == self._snapshot_glob
+        ):
+            return Watcher.is_changed(self, path, ignore)
+
+        if isinstance(path, (list, tuple)):
+            path = path[1]
+
+        snapshot = {}
+        changed = False
+        abs_task_path = os.path.abspath(path)
+        abs_prefix = os.path.join(abs_task_path, "")
+
+        ignored_dirs = self._ignored_dirs
+        for abs_path in self._pending_changes:
+            if abs_path == abs_task_path:
+                changed_path = path
+            elif abs_path.startswith(abs_prefix):
+                relpath = abs_path[len(abs_prefix) :]
+                if not ignored_dirs.isdisjoint(relpath.split(os.sep)):
+                    # inotify watches ignored directories like .git too
+                    continue
+                changed_path = os.path.join(path, relpath)
+            else:
+                continue
+
+            if self._is_ignored(changed_path, ignore):
+                continue
+
+            try:
+                stat_result = os.stat(changed_path)
+            except OSError:
+                if self._forget_path(changed_path):
+                    changed = True
+                continue
+
+            if S_ISREG(stat_result.st_mode):
+                snapshot[changed_path] = _fingerprint(stat_result)
+            elif S_ISDIR(stat_result.st_mode):
+                snapshot.update(self._snapshot_folder(changed_path, ignore))
+
+        if self._diff_snapshot(snapshot):
+            changed = True
+
+        self._new_mtimes = snapshot
+        self._task_mtimes.update(snapshot)
+        return changed
+
+    def _forget_path(self, path):
+        """Drop a removed filepath, or everything below a removed directory,
+        from self._task_mtimes. Returns True if anything was tracked."""
+        if path in self._task_mtimes:
+            removed_paths = [path]
+        else:
+            prefix = os.path.join(path, "")
+            removed_paths = [p for p in self._task_mtimes if p.startswith(prefix)]
+
+        for removed_path in removed_paths:
+            self._task_mtimes.pop(removed_path)
+            self.filepath = removed_path
+        return bool(removed_paths)
 
     def start(self, callback):
         if not self.notifier:
             self.callback = callback
 
             from tornado import ioloop
+            from tornado.queues import Queue
 
-            self.notifier = pyinotify.TornadoAsyncNotifier(
-                self.wm, ioloop.IOLoop.instance(), default_proc_fun=self.inotify_event
+            self.ioloop = ioloop.IOLoop.instance()
+            self._queue = Queue(maxsize=self.queue_size)
+            self.ioloop.spawn_callback(self._consume)
+            self.notifier = pyinotify.Notifier(
+                self.wm, default_proc_fun=self.inotify_event, timeout=0
+            )
+            self.ioloop.add_handler(
+                self.wm.get_fd(), self._drain, ioloop.IOLoop.READ
             )
+            # the first callback takes a full snapshot of every task, events
+            # are compared against it later, so that e.g. removing a file
+            # that existed at start is noticed
+            self._rescan = True
             callback()
         return True
 
+    def _drain(self, fd, events):
+        """Read and process the inotify events queued up meanwhile.
+
+        Reads at most drain_reads times, so a steady stream of events can't
+        keep the IOLoop from running anything else. The fd stays readable
+        while events are left, and the IOLoop calls back for the rest.
+        """
+        for _ in range(self.drain_reads):
+            if not self.notifier.check_events():
+                break
+            self.notifier.read_events()
+            self.notifier.process_events()
+
 
 def get_watcher_class():
-    if pyinotify is None or not hasattr(pyinotify, "TornadoAsyncNotifier"):
+    if pyinotify is None:
         return Watcher
     return INotifyWatcher